@@ -1,18 +1,88 @@
+import itertools
+import math
 import sys
 import zipfile
 
+# primes below n using sieve of eratosthenes
+def sieve(n):
+    is_prime = bytearray([1])*n
+    is_prime[:2] = b'\x00\x00'
+    for i in range(2,int(n**0.5)+1):
+        if is_prime[i]:
+            is_prime[i*i::i] = bytes(len(range(i*i,n,i)))
+    return [i for i in range(n) if is_prime[i]]
+
+# trial division primes, computed once instead of generating trial divisors
+SMALL_PRIMES = sieve(2**16)
+
+# miller rabin test with the first 13 primes as bases
+# deterministic for n < 3317044064679887385961981, probable prime above that
+def is_prime(n):
+    if n < 2: return False
+    for p in SMALL_PRIMES[:13]:
+        if n % p == 0: return n == p
+    s = 0
+    d = n-1
+    while d % 2 == 0: # n-1 == d * 2**s
+        s += 1
+        d //= 2
+    for a in SMALL_PRIMES[:13]:
+        x = pow(a,d,n)
+        if x == 1 or x == n-1: continue
+        for _ in range(s-1):
+            x = x*x % n
+            if x == n-1: break
+        else: return False
+    return True
+
+# pollard rho with brent cycle detection, n must be odd and composite
+# returns a nontrivial factor of n
+def pollard_rho(n):
+    c = 1
+    while True: # f(x) = x*x+c, try another c if the cycle gives n
+        y,r,q,g = 2,1,1,1
+        x = ys = y
+        while g == 1:
+            x = y
+            for _ in range(r):
+                y = (y*y+c) % n
+            k = 0
+            while k < r and g == 1: # batch gcd computations
+                ys = y
+                for _ in range(min(128,r-k)):
+                    y = (y*y+c) % n
+                    q = q*abs(x-y) % n
+                g = math.gcd(q,n)
+                k += 128
+            r *= 2
+        if g == n: # backtrack from last batch one step at a time
+            g = 1
+            while g == 1:
+                ys = (ys*ys+c) % n
+                g = math.gcd(abs(x-ys),n)
+        if g != n:
+            return g
+        c += 1
+
 def factors(n):
     assert type(n) == int and n >= 2
     result = []
-    while n % 2 == 0:
-        result.append(2)
-        n //= 2
-    d = 3
-    while d*d <= n:
-        while n % d == 0:
-            result.append(d)
-            n //= d
-        d += 2
+    for p in SMALL_PRIMES:
+        if p*p > n: break
+        while n % p == 0:
+            result.append(p)
+            n //= p
+    else: # n may be composite with factors above the table, split with rho
+        large = []
+        stack = [n] if n != 1 else []
+        while stack:
+            m = stack.pop()
+            if is_prime(m):
+                large.append(m)
+            else:
+                d = pollard_rho(m)
+                stack += [d,m//d]
+        return result + sorted(large)
     if n != 1:
         result.append(n)
     return result
@@ -33,18 +103,29 @@ sys.stderr.write('processing ".par" files in archive\n')
 
 for arcname in contents:
     if not arcname.endswith('.par'): continue
-    job_output = input.read(arcname).decode().splitlines()
-    if len(job_output) < 5 or job_output[-1] != 'done':
+    # lines are streamed as bytes (int() parses them without decoding)
+    # the first pass only counts lines and keeps the last one, so unfinished
+    # files (the last line may be partial) are skipped before any checks
+    num_lines = 0
+    last_line = b''
+    with input.open(arcname) as job_output:
+        for last_line in job_output:
+            num_lines += 1
+    if num_lines < 5 or last_line.rstrip(b'\n') != b'done':
         sys.stderr.write('warning: "%s" does not end with "done"\n'%arcname)
-    else:
-        assert job_output[0] == 'TYPE=FPP'
-        assert job_output[1].startswith('BASE=')
-        assert job_output[2].startswith('LO_BOUND=')
-        assert job_output[3].startswith('HI_BOUND=')
-        out_base = int(job_output[1][5:])
+        continue
+    # second pass checks the finished file
+    with input.open(arcname) as job_output:
+        lines = (line.rstrip(b'\n') for line in job_output)
+        header = list(itertools.islice(lines,4))
+        assert header[0] == b'TYPE=FPP'
+        assert header[1].startswith(b'BASE=')
+        assert header[2].startswith(b'LO_BOUND=')
+        assert header[3].startswith(b'HI_BOUND=')
+        out_base = int(header[1][5:])
         assert out_base == base
-        out_lo = int(job_output[2][9:])
-        out_hi = int(job_output[3][9:])
+        out_lo = int(header[2][9:])
+        out_hi = int(header[3][9:])
         index = out_lo // 2**30 # job number based on pseudoprime range
         assert 0 <= index < 4096
         if index == 0:
@@ -53,14 +134,14 @@ for arcname in contents:
             assert out_lo % 2**30 == 0 and out_hi == out_lo + 2**30-1
         job_nums = []
         prev_num = 0
-        for i in range(4,len(job_output)-1):
-            side = job_output[i][0]
-            num = int(job_output[i][1:])
+        for line in itertools.islice(lines,num_lines-5):
+            side = line[:1]
+            num = int(line[1:])
             assert num > prev_num
             prev_num = num
             assert out_lo <= num <= out_hi
-            if side == '>': skipped_primes.append(num)
-            elif side == '<':
+            if side == b'>': skipped_primes.append(num)
+            elif side == b'<':
                 assert pow(base,num-1,num) == 1 # verify probable primality
                 job_nums.append(num)
             else: assert 0
@@ -71,10 +152,17 @@ input.close()
 sys.stderr.write('finalizing\n')
 assert set(skipped_primes) == set(factors(base))
 assert all(job_nums != None for job_nums in job_pseudoprimes)
-out_pp = []
-for job_nums in job_pseudoprimes: out_pp += job_nums
-#out_pp = sum(job_pseudoprimes,[])
-#assert all(out_pp[i] < out_pp[i+1] for i in range(len(out_pp)-1))
 sys.stderr.write('writing\n')
-sys.stdout.write('\n'.join(map(str,out_pp)) + '\n')
+# write numbers from all jobs in order to a single reused buffer
+# flushed in chunks, so no combined list or job sized string is created
+OUT_BUFFER_SIZE = 2**20
+output = sys.stdout.buffer
+out_buf = bytearray()
+for num in itertools.chain.from_iterable(job_pseudoprimes):
+    out_buf += b'%d\n'%num
+    if len(out_buf) >= OUT_BUFFER_SIZE:
+        output.write(out_buf)
+        out_buf.clear()
+output.write(out_buf)
+output.flush()
 sys.stderr.write('done\n')
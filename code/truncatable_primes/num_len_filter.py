@@ -2,14 +2,61 @@
 # read integers (as base 10) from stdin (1 per line) and using given base
 # output (in base 10) the numbers with length1 (or length2...) digits
 import sys
+from math import log10
 base = int(sys.argv[1])
 assert base >= 2
-def has_n_digits(num,n):
-    return base**(n-1) <= num < base**n
 nvals = [int(a) for a in sys.argv[2:]]
 for nval in nvals:
     assert nval > 0
-for line in sys.stdin:
-    num = int(line)
-    if any(has_n_digits(num,nval) for nval in nvals):
-        print(line,end='')
+# [lo,hi) range of numbers for each length, computed once
+pows = sorted({(base**(nval-1),base**nval) for nval in nvals})
+# decimal length of num >= 1, estimated from the bit length and corrected
+# (str(num) is limited to 4300 digits)
+def dec_len(num: int) -> int:
+    d = int((num.bit_length()-1)*log10(2))+1
+    while 10**d <= num:
+        d += 1
+    while d > 1 and 10**(d-1) > num:
+        d -= 1
+    return d
+# decimal lengths of the numbers in those ranges, other lines are skipped
+# without parsing them (base 10 needs no further check)
+dec_lens = set()
+for lo,hi in pows:
+    dec_lens.update(range(dec_len(lo),dec_len(hi-1)+1))
+if base == 10:
+    check = None
+elif base == 2:
+    nvals_set = set(nvals)
+    check = lambda num: num.bit_length() in nvals_set
+else: # generate a function with the bounds as constants, merging ranges
+    ranges = [list(pows[0])]
+    for lo,hi in pows[1:]:
+        if lo == ranges[-1][1]:
+            ranges[-1][1] = hi
+        else:
+            ranges.append([lo,hi])
+    src = 'def check(num):\n    return ' + ' or '.join(
+        f'({lo:#x} <= num < {hi:#x})' for lo,hi in ranges)
+    namespace = dict()
+    exec(src,namespace)
+    check = namespace['check']
+OUT_BUFFER_SIZE = 2**16
+output = sys.stdout.buffer
+out_buf = bytearray()
+in_range = lambda num: any(lo <= num < hi for lo,hi in pows)
+for line in sys.stdin.buffer:
+    digits = line.rstrip()
+    # the length skip only applies to digits without leading zeros, other
+    # lines (0, signs, spaces) are parsed and checked normally
+    if digits.isdigit() and digits[:1] != b'0':
+        keep = len(digits) in dec_lens and (check is None or check(int(digits)))
+    else:
+        keep = in_range(int(line))
+    if keep:
+        out_buf += line
+        if len(out_buf) >= OUT_BUFFER_SIZE:
+            output.write(out_buf)
+            out_buf.clear()
+output.write(out_buf)
+output.flush()
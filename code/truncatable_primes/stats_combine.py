@@ -9,6 +9,7 @@
 # use job_roots_all.txt to find the root_#.csv files to add
 # (job_roots_all.txt includes duplicates for left-or-right primes)
 
+import operator
 import os
 import re
 import sys
@@ -36,64 +37,68 @@ job_roots = open(input_dir+'/job_roots_all.txt','r').read().splitlines()
 
 class StatsFile:
     def __init__(self,file:str):
-        lines = open(file,'r').read().splitlines()
-        table_lines = [line for line in lines if not line.startswith('#')]
-        comment_lines = [line for line in lines if line.startswith('#')]
-        # set properties from comments
+        # single pass over the file, comment lines are properties and table
+        # rows are split into the first column and the integer values
         props = dict()
-        for comment in comment_lines:
-            comment = comment.split()
-            if len(comment) == 4: # lines with "# prop = value"
-                props[comment[1]] = comment[3]
+        header = None
+        rows = [] # (first column, values) for each row after the header
+        with open(file,'r') as f:
+            for line in f:
+                if line.startswith('#'):
+                    comment = line.split()
+                    if len(comment) == 4: # lines with "# prop = value"
+                        props[comment[1]] = comment[3]
+                elif header is None:
+                    header = line
+                else:
+                    first,values = line.split(',',1)
+                    rows.append((first,list(map(int,values.split(',')))))
+        # set properties from comments
         self.prime_type = props['prime_type']
         self.base = int(props['base'])
         self.root = int(props['root'])
         self.max_length = int(props['max_length'])
         self.hash = int(props['hash'])
         # parse table stuff
-        self.pmin = dict() # len -> (all,[0,1,.. (num children)])
+        self.pmin = dict() # len -> [all,0,1,.. (num children)]
         self.pmax = dict()
         self.counts = dict()
-        assert len(table_lines) % 3 == 1
-        assert table_lines[0].startswith('digits,all')
-        table_lines = table_lines[1:]
-        for i in range(0,len(table_lines),3):
-            row = table_lines[i].split(',')
-            num_len = int(row[0])
-            self.counts[num_len] = (int(row[1]),[int(k) for k in row[2:]])
-            row = table_lines[i+1].split(',')
-            self.pmin[num_len] = (int(row[1]),[int(k) for k in row[2:]])
-            row = table_lines[i+2].split(',')
-            self.pmax[num_len] = (int(row[1]),[int(k) for k in row[2:]])
-            assert len(self.counts[num_len][1]) == max_children
-            assert len(self.pmin[num_len][1]) == max_children
-            assert len(self.pmax[num_len][1]) == max_children
-
-# accumulator functions for updating the values
-umin = lambda acc,x: min(acc,x) if acc != 0 and x != 0 else max(acc,x)
-umax = lambda acc,x: max(acc,x)
-
-# stats objects
-pmin = dict() # length -> (children -> min prime)
-pmax = dict() # length -> (children -> max prime)
-counts = dict() # length -> (children -> count)
+        assert header is not None and header.startswith('digits,all')
+        assert len(rows) % 3 == 0
+        for i in range(0,len(rows),3):
+            num_len = int(rows[i][0])
+            self.counts[num_len] = rows[i][1]
+            self.pmin[num_len] = rows[i+1][1]
+            self.pmax[num_len] = rows[i+2][1]
+            assert len(self.counts[num_len]) == max_children+1
+            assert len(self.pmin[num_len]) == max_children+1
+            assert len(self.pmax[num_len]) == max_children+1
+
+# accumulator functions for updating the values (0 means no prime)
+# values are nonnegative so min is 0 only if one value is 0, then the sum is
+# the other value, this avoids testing each value for 0
+umin = lambda acc,x: min(acc,x) or acc+x
+umax = max
+
+# stats objects, index 0 is for all, index i+1 for i children
+pmin = dict() # length -> [min prime]
+pmax = dict() # length -> [max prime]
+counts = dict() # length -> [count]
 
 # update stats objects with new information
+# the all column is combined in the same pass as the children columns
+# rows for a new length are taken as is, combining with zeroes is a no-op
 def apply_updates(sf: StatsFile, len_filter: Callable[[int],bool]):
     for length in filter(len_filter,sf.counts.keys()):
         if length not in counts:
-            counts[length] = (0,[0]*max_children)
-            pmin[length] = (0,[0]*max_children)
-            pmax[length] = (0,[0]*max_children)
-        a,l = counts[length]
-        a2,l2 = sf.counts[length]
-        counts[length] = (a+a2,[l[i]+l2[i] for i in range(len(l))])
-        a,l = pmin[length]
-        a2,l2 = sf.pmin[length]
-        pmin[length] = (umin(a,a2),[umin(l[i],l2[i]) for i in range(len(l))])
-        a,l = pmax[length]
-        a2,l2 = sf.pmax[length]
-        pmax[length] = (umax(a,a2),[umax(l[i],l2[i]) for i in range(len(l))])
+            counts[length] = sf.counts[length]
+            pmin[length] = sf.pmin[length]
+            pmax[length] = sf.pmax[length]
+            continue
+        counts[length] = list(map(operator.add,counts[length],
+                                  sf.counts[length]))
+        pmin[length] = list(map(umin,pmin[length],sf.pmin[length]))
+        pmax[length] = list(map(umax,pmax[length],sf.pmax[length]))
 
 sf = StatsFile(input_dir+'/root.csv')
 apply_updates(sf, lambda x: x <= split_len)
@@ -119,9 +124,9 @@ else:
     len_order = sorted(counts.keys())
 print('digits,all'+''.join(f',{k}' for k in range(max_children)))
 for l in len_order:
-    print(f'{l},{counts[l][0]}'+''.join(f',{s}' for s in counts[l][1]))
-    print(f',{pmin[l][0]}'+''.join(f',{s}' for s in pmin[l][1]))
-    print(f',{pmax[l][0]}'+''.join(f',{s}' for s in pmax[l][1]))
+    print(f'{l}'+''.join(f',{s}' for s in counts[l]))
+    print(''.join(f',{s}' for s in pmin[l]))
+    print(''.join(f',{s}' for s in pmax[l]))
 
 # compute hash
 import truncprimes
@@ -134,15 +139,30 @@ funcs = \
     'lar': truncprimes.tp_lar
 }
 rootbytes = b'\xff'*((len(prime_type)+1)//2)
-tptree,tpbytes,tphash = funcs[prime_type](base,0,0,rootbytes,depth)
+tptree,tpbytes,tphash = funcs[prime_type](base,0,truncprimes.mpz(0),
+                                           rootbytes,depth)
 
+# post order with a stack of [hash,children iterator,digit] for the path
+# subtrees with a known hash (job roots) are not descended into
 def cust_hash(root: truncprimes.TPTree, hashes: Dict[int,int]) -> int:
+    hash_init = truncprimes.hash_init
+    hash_update = truncprimes.hash_update
     (_,number,_),children = root
     if number in hashes:
         return hashes[number]
-    hash = truncprimes.hash_init(number)
-    for d in children:
-        hash = truncprimes.hash_update(hash,d,cust_hash(children[d],hashes))
-    return hash
+    stack = [[hash_init(number),iter(children.items()),0]]
+    while True:
+        frame = stack[-1]
+        for d,((_,number,_),children) in frame[1]:
+            if number in hashes:
+                frame[0] = hash_update(frame[0],d,hashes[number])
+            else:
+                stack.append([hash_init(number),iter(children.items()),d])
+                break
+        else: # all children done
+            stack.pop()
+            if not stack:
+                return frame[0]
+            stack[-1][0] = hash_update(stack[-1][0],frame[2],frame[0])
 
 print(f'# hash = {cust_hash(tptree,root2hash)}')
@@ -13,6 +13,7 @@ Call .generator() to get the object it is setup for
 '''
 
 from typing import Any, BinaryIO, Callable, Generator, List, Tuple
+import io
 import sys
 
 # (length, prime) (for pre order, number of child nodes not known yet)
@@ -38,12 +39,12 @@ def _read_next_byte(buf: BinaryIO = sys.stdin.buffer) -> bytes:
     return b
 
 # returns b'\xff' for end byte, otherwise size bytes for the value
+# buf must support peek() (io.BufferedReader) so a value is a single read
 def _read_next_value(size: int, buf: BinaryIO = sys.stdin.buffer) -> bytes:
-    b = _read_next_byte(buf)
-    if b == END:
-        return b
-    for i in range(1,size):
-        b += _read_next_byte(buf)
+    if size == 1 or buf.peek(1)[:1] == END:
+        return _read_next_byte(buf)
+    b = buf.read(size)
+    assert len(b) == size
     return b
 
 # counts digits of v in base b
@@ -62,6 +63,7 @@ class TPTreeBase:
     buf: BinaryIO
     vsize: int
     nextp: NextPrime
+    pows: List[int]
     def __init__(self, ptype: str, base: int, root: int = 0,
             buf: BinaryIO = sys.stdin.buffer):
         assert ptype in ['r','l','lor','lar']
@@ -70,8 +72,11 @@ class TPTreeBase:
         self.base = base
         assert root >= 0
         self.root = root
+        if not hasattr(buf,'peek'): # needed for reading values
+            buf = io.BufferedReader(buf,buffer_size=2**20)
         self.buf = buf
         self.vsize = 1+(len(ptype)//2) # 1 for r,l and 2 for lor,lar
+        self.pows = [1] # base**k, extended as needed
         self.nextp = \
         {
             'r': self._next_r,
@@ -79,12 +84,18 @@ class TPTreeBase:
             'lor': self._next_lor,
             'lar': self._next_lar
         }[ptype]
+    # returns base**k, caching powers so each is only computed once
+    def _pow(self, k: int) -> int:
+        pows = self.pows
+        while len(pows) <= k:
+            pows.append(pows[-1]*self.base)
+        return pows[k]
     def _next_r(self, l: int, v: int, b: bytes) -> Tuple[int,int]:
         assert 0 < b[0] < self.base
         return (l+1,self.base*v+b[0])
     def _next_l(self, l: int, v: int, b: bytes) -> Tuple[int,int]:
         assert 0 < b[0] < self.base
-        return (l+1,v+(10**l)*b[0])
+        return (l+1,v+self._pow(l)*b[0])
     def _next_lor(self, l: int, v: int, b: bytes) -> Tuple[int,int]:
         assert 0 < b[1] < self.base
         if b[0] == 0:
@@ -100,20 +111,29 @@ class TPTreeBase:
             return (2 if b[0] else 1,self.base*b[0]+b[1])
         else:
             assert 0 < b[0] < self.base and 0 < b[1] < self.base
-            return (l+2,self.base*v+b[1]+(10**(l+1))*b[0])
+            return (l+2,self.base*v+b[1]+self._pow(l+1)*b[0])
     def generator(self) -> Any:
         assert 0, 'must override generator'
 
 # generator object for (length,number) in pre order
 class TPTreePreOrder(TPTreeBase):
+    # iterative, stack has (length,number) for the current path
     def _generator(self, l: int, n: int) -> Generator[TreeNodePre,None,None]:
+        read_next_value = _read_next_value
+        nextp = self.nextp
+        buf = self.buf
+        vsize = self.vsize
         yield (l,n)
-        while True:
-            v = _read_next_value(self.vsize,self.buf)
+        stack: List[TreeNodePre] = [(l,n)]
+        while stack:
+            v = read_next_value(vsize,buf)
             if v == END:
-                break
-            l2,n2 = self.nextp(l,n,v)
-            yield from self._generator(l2,n2)
+                stack.pop()
+            else:
+                l,n = stack[-1]
+                node = nextp(l,n,v)
+                yield node
+                stack.append(node)
     def generator(self) -> Generator[TreeNodePre,None,None]:
         for _ in range(self.vsize): # skip root
             _read_next_byte(self.buf)
@@ -121,16 +141,23 @@ class TPTreePreOrder(TPTreeBase):
 
 # generator object for (length,number,children) in post order
 class TPTreePostOrder(TPTreeBase):
+    # iterative, stack has [length,number,children] for the current path
     def _generator(self, l: int, n: int) -> Generator[TreeNodePost,None,None]:
-        c = 0
-        while True:
-            v = _read_next_value(self.vsize,self.buf)
+        read_next_value = _read_next_value
+        nextp = self.nextp
+        buf = self.buf
+        vsize = self.vsize
+        stack: List[List[int]] = [[l,n,0]]
+        while stack:
+            v = read_next_value(vsize,buf)
             if v == END:
-                break
-            c += 1
-            l2,n2 = self.nextp(l,n,v)
-            yield from self._generator(l2,n2)
-        yield (l,n,c)
+                l,n,c = stack.pop()
+                yield (l,n,c)
+            else:
+                top = stack[-1]
+                top[2] += 1
+                l2,n2 = nextp(top[0],top[1],v)
+                stack.append([l2,n2,0])
     def generator(self) -> Generator[TreeNodePost,None,None]:
         for _ in range(self.vsize): # skip root
             _read_next_byte(self.buf)
@@ -138,15 +165,24 @@ class TPTreePostOrder(TPTreeBase):
 
 # creates the full tree object with values only
 class TPTreeFull(TPTreeBase):
+    # iterative, stack has (length,number,children) for the current path
     def _generator(self, l: int, n: int) -> TPTree:
-        children: list[TPTree] = []
+        read_next_value = _read_next_value
+        nextp = self.nextp
+        buf = self.buf
+        vsize = self.vsize
+        stack: List[Tuple[int,int,List[TPTree]]] = [(l,n,[])]
         while True:
-            v = _read_next_value(self.vsize,self.buf)
+            v = read_next_value(vsize,buf)
             if v == END:
-                break
-            l2,n2 = self.nextp(l,n,v)
-            children.append(self._generator(l2,n2))
-        return (n,children)
+                _,n,children = stack.pop()
+                if not stack:
+                    return (n,children)
+                stack[-1][2].append((n,children))
+            else:
+                l,n,_ = stack[-1]
+                l2,n2 = nextp(l,n,v)
+                stack.append((l2,n2,[]))
     def generator(self) -> TPTree:
         for _ in range(self.vsize): # skip root
             _read_next_byte(self.buf)
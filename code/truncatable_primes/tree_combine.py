@@ -10,8 +10,10 @@
 # this program fills in the uncomputed trees left to the jobs
 # for left-or-right truncatable primes, duplicate subtrees are filled
 
+import mmap
 import os
 import re
+import shutil
 import sys
 
 job_re = re.compile(r'root_(\d+).bin')
@@ -28,16 +30,30 @@ for f in os.listdir(input_dir):
         job_files[int(m.groups()[0])] = input_dir+'/'+f
 
 BUFFER_SIZE = 2**24
-root_bin = open(input_dir+'/root.bin','rb')
+OUT_BUFFER_SIZE = 2**20
+root_file = open(input_dir+'/root.bin','rb')
+root_bin = mmap.mmap(root_file.fileno(),0,prot=mmap.PROT_READ)
+root_pos = 0 # index of next byte to read from root_bin
 tree_bin = open(input_dir+'/tree.bin','wb',buffering=BUFFER_SIZE)
+out_buf = bytearray() # bytes not yet written to tree_bin
 
 # read a byte from root_bin
 def read_byte() -> int:
-    return root_bin.read(1)[0]
+    global root_pos
+    b = root_bin[root_pos]
+    root_pos += 1
+    return b
+
+# write out_buf contents to tree_bin
+def flush_out_buf():
+    tree_bin.write(out_buf)
+    out_buf.clear()
 
 # write a byte to tree_bin
 def write_byte(b: int):
-    tree_bin.write(bytes([b]))
+    out_buf.append(b)
+    if len(out_buf) >= OUT_BUFFER_SIZE:
+        flush_out_buf()
 
 # copy entire contents to tree_bin skipping skip bytes (the root value)
 # otherwise if file does not exist, just write the end byte
@@ -45,11 +61,21 @@ def write_byte(b: int):
 def write_job_subtree(val: int, skip: int):
     if val in job_files:
         job_file = open(job_files[val],'rb',buffering=BUFFER_SIZE)
-        job_file.read(skip)
-        # TODO perhaps write chunks instead of reading entire file
-        data = job_file.read()
-        #print(f'writing {len(data)} bytes from {job_files[val]}')
-        tree_bin.write(data)
+        flush_out_buf() # keep bytes in order
+        # copy in the kernel, by file descriptors (only linux supports
+        # sendfile to a regular file, other systems require a socket)
+        if sys.platform.startswith('linux'):
+            tree_bin.flush()
+            offset = skip
+            size = os.fstat(job_file.fileno()).st_size
+            while offset < size:
+                sent = os.sendfile(tree_bin.fileno(),job_file.fileno(),
+                                   offset,size-offset)
+                assert sent > 0
+                offset += sent
+        else:
+            job_file.read(skip)
+            shutil.copyfileobj(job_file,tree_bin,2**20)
         job_file.close()
         used_jobs.add(val)
     else:
@@ -62,41 +88,65 @@ def write_job_subtree(val: int, skip: int):
 # the caller reads the value to calculate the next number for recursion
 # the subtrees and end byte read are rewritten, but the job files
 # are used to fill in the appropriate leaf recursion nodes
+# the tree is walked with an explicit stack of the nodes being read
+# first is true until the node on top of the stack has a child read, an end
+# byte read at that point means a leaf node (filled in from a job file)
 
 def primes_r(val: int, base: int):
-    d = read_byte() # subtree value
-    if d == 255: # leaf node, copy appropriate file if it exists
-        write_job_subtree(val,1)
-        return
-    while d != 255:
+    stack = [val]
+    first = True
+    while stack:
+        d = read_byte() # subtree value
+        if d == 255: # end of node
+            if first: # leaf node, copy appropriate file if it exists
+                write_job_subtree(stack[-1],1)
+            else:
+                write_byte(255) # end
+            stack.pop()
+            first = False
+            continue
         assert 0 < d < base
         write_byte(d)
-        primes_r(base*val+d,base)
-        d = read_byte()
-    write_byte(255) # end
+        stack.append(base*stack[-1]+d)
+        first = True
 
 def primes_l(val: int, power: int, base: int):
-    d = read_byte()
-    if d == 255: # leaf node
-        write_job_subtree(val,1)
-        return
-    while d != 255:
+    stack = [(val,power)]
+    first = True
+    while stack:
+        d = read_byte()
+        if d == 255: # end of node
+            if first: # leaf node
+                write_job_subtree(stack[-1][0],1)
+            else:
+                write_byte(255) # end
+            stack.pop()
+            first = False
+            continue
         assert 0 < d < base
         write_byte(d)
-        primes_l(d*power+val,power*base,base)
-        d = read_byte()
-    write_byte(255) # end
+        val,power = stack[-1]
+        stack.append((d*power+val,power*base))
+        first = True
 
 def primes_lor(val: int, power: int, base: int):
-    side = read_byte()
-    if side == 255: # leaf node
-        write_job_subtree(val,2)
-        return
-    while side != 255:
+    stack = [(val,power)]
+    first = True
+    while stack:
+        side = read_byte()
+        if side == 255: # end of node
+            if first: # leaf node
+                write_job_subtree(stack[-1][0],2)
+            else:
+                write_byte(255) # end
+            stack.pop()
+            first = False
+            continue
         digit = read_byte()
         assert 0 < digit < base
         write_byte(side)
         write_byte(digit)
+        val,power = stack[-1]
         if side == 0:
             val2 = digit*power+val
         elif side == 1:
@@ -104,17 +154,24 @@ def primes_lor(val: int, power: int, base: int):
         else:
             val2 = 0 # to suppress error
             assert 0
-        primes_lor(val2,power*base,base)
-        side = read_byte()
-    write_byte(255) # end
+        stack.append((val2,power*base))
+        first = True
 
 def primes_lar(val: int, power: int, base: int):
-    ld = read_byte() # left digit
-    if ld == 255: # leaf node
-        write_job_subtree(val,2)
-        return
-    while ld != 255:
+    stack = [(val,power)]
+    first = True
+    while stack:
+        ld = read_byte() # left digit
+        if ld == 255: # end of node
+            if first: # leaf node
+                write_job_subtree(stack[-1][0],2)
+            else:
+                write_byte(255) # end
+            stack.pop()
+            first = False
+            continue
         rd = read_byte() # right digit
+        val,power = stack[-1]
         if val == 0: # root of entire tree allows zeroes
             assert 0 <= ld < base
             assert 0 <= rd < base
@@ -124,11 +181,10 @@ def primes_lar(val: int, power: int, base: int):
         write_byte(ld)
         write_byte(rd)
         if ld != 0: # double digit, multiply power by base^2
-            primes_lar(ld*power+base*val+rd,power*base*base,base)
+            stack.append((ld*power+base*val+rd,power*base*base))
         else: # single digit, multiply power by base^1
-            primes_lar(ld*power+base*val+rd,power*base,base)
-        ld = read_byte()
-    write_byte(255) # end
+            stack.append((ld*power+base*val+rd,power*base))
+        first = True
 
 # extract root value bytes and write root bytes
 assert read_byte() == 255
@@ -149,7 +205,9 @@ elif prime_type == 'lar':
 else:
     assert 0
 
+flush_out_buf()
 root_bin.close()
+root_file.close()
 tree_bin.close()
 
 unused = set(job_files.keys()) - used_jobs
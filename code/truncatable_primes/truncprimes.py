@@ -1,58 +1,85 @@
 import argparse
 import gmpy2
-from typing import Dict, List, Tuple
+import hashlib
+import multiprocessing
+import sys
+from array import array
+from collections import Counter
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import lru_cache
+from math import gcd, log2, prod
+from gmpy2 import mpz, powmod
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 # PRP test with base a, n > 1, usually 1 < a < n-1
 # should ensure gcd(a,n)=1 but not required
+# modular arithmetic is done with GMP (mpz)
 def prp(n: int, a: int = 2) -> bool:
     # assert n > 1 and a >= 1
-    return pow(a,n-1,n) == 1
+    n = mpz(n)
+    return powmod(a,n-1,n) == 1
 
 # SPRP test with base a, n > 2 odd, usually 1 < a < n-1
+# the whole test runs in GMP which requires a >= 2 and gcd(a,n) = 1,
+# otherwise the result is known (a^d = 1 or -1 mod n requires gcd(a,n) = 1)
 def sprp(n: int, a: int = 2) -> bool:
     # assert n > 2 and n % 2 == 1 and a >= 1
-    s = 0
-    d = n-1
-    while d % 2 == 0: # n-1 == d * 2**s
-        s += 1
-        d //= 2
-    res = pow(a,d,n)
-    if res == 1 or res == n-1:
+    if a == 1:
         return True
-    return any((res := (res*res) % n) == n-1 for _ in range(s-1))
+    return gmpy2.gcd(n,a) == 1 and gmpy2.is_strong_prp(n,a)
+
+# primes below 256 and their product, a single gcd with the product rejects
+# most composites before the more expensive BPSW test
+SMALL_PRIMES = frozenset(p for p in range(256) if gmpy2.is_prime(p))
+SMALL_PRIMORIAL = mpz(prod(SMALL_PRIMES))
 
 # probable prime test to use when computing numbers
 # subtrees can be pruned by a proper primality test afterward
 # all primes will be output, but some pseudoprimes may be present
+# results are cached since left-or-right primes reach numbers more than once
+@lru_cache(maxsize=2**16)
 def prob_prime_test(n: int) -> bool:
     #return n == 2 or (n % 2 == 1 and n > 2 and prp(n))
     #return n == 2 or (n % 2 == 1 and n > 2 and sprp(n))
-    return gmpy2.is_bpsw_prp(n)
+    if n < 256:
+        return n in SMALL_PRIMES
+    return gmpy2.gcd(n,SMALL_PRIMORIAL) == 1 and gmpy2.is_bpsw_prp(n)
 
 # counts digits of n in base b, returns 0 if n == 0
+# estimated from the bit length, then corrected by comparing with powers of b
 def count_digits(n: int, b: int) -> int:
     assert n >= 0
     assert b > 1
-    d = 0
-    while n:
+    if n == 0:
+        return 0
+    if b == 2:
+        return n.bit_length()
+    d = int((n.bit_length()-1)/log2(b))+1
+    while b**d <= n:
         d += 1
-        n //= b
+    while d > 1 and b**(d-1) > n:
+        d -= 1
     return d
 
+# hash values are 64 bit, masking is cheaper than % 2**64 on python ints
+HASH_MASK = 2**64-1
+
 # based on lower 64 bits of the prime
 def hash_init(num: int) -> int:
-    return (num%2**64)//2
+    return int(num & HASH_MASK) >> 1
 
-# rotate 32 bits
+# rotate 19 bits left
 def hash_rot(num: int) -> int:
-    return ((num >> 45) | (num << 19)) & (2**64-1)
+    return ((num >> 45) | (num << 19)) & HASH_MASK
 
 # mix in the new values to scramble the hash value
+# (hash_rot is inlined, this is called for every node)
 def hash_update(h: int, d: int, c: int) -> int:
-    return h ^ hash_rot((8191*(127*h-d)+c)%2**64)
+    x = (8191*(127*h-d)+c) & HASH_MASK
+    return h ^ (((x >> 45) | (x << 19)) & HASH_MASK)
 
 '''
-Recursive functions return tuple (tree,bytes,hash)
+Tree functions return tuple (tree,bytes,hash)
 '''
 
 # node is (length,number,hash) and list of children
@@ -60,118 +87,217 @@ TPNode = Tuple[int,int,int] # len,num,hash(subtree)
 TPTree = Tuple[TPNode,Dict[int,'TPTree']]
 TPRet = Tuple[TPTree,bytes,int]
 
-def tp_r(base: int, len: int, num: int, root: bytes, maxlen: int) -> TPRet:
-    children = dict()
-    output = root
-    hash = hash_init(num)
-    for d in range(1,base) if len+1 <= maxlen else []:
-        num2 = num*base+d
-        if prob_prime_test(num2):
-            ctree,cbytes,chash = tp_r(base,len+1,num2,bytes([d]),maxlen)
-            children[d] = ctree
-            output += cbytes
-            hash = hash_update(hash,d,chash)
-    output += b'\xff' # end
-    return (((len,num,hash),children),output,hash)
-
-def tp_l(base: int, len: int, num: int, root: bytes, maxlen: int) -> TPRet:
-    children = dict()
-    output = root
-    hash = hash_init(num)
-    for d in range(1,base) if len+1 <= maxlen else []:
-        num2 = d*(base**len)+num
-        if prob_prime_test(num2):
-            ctree,cbytes,chash = tp_l(base,len+1,num2,bytes([d]),maxlen)
-            children[d] = ctree
-            output += cbytes
-            hash = hash_update(hash,d,chash)
-    output += b'\xff' # end
-    return (((len,num,hash),children),output,hash)
-
-def tp_lor(base: int, len: int, num: int, root: bytes, maxlen: int) -> TPRet:
-    children = dict()
-    output = root
-    hash = hash_init(num)
-    for d in range(1,base) if len+1 <= maxlen else []: # left
-        num2 = d*(base**len)+num
-        if prob_prime_test(num2):
-            ctree,cbytes,chash = tp_lor(base,len+1,num2,bytes([0,d]),maxlen)
-            children[d] = ctree
-            output += cbytes
-            hash = hash_update(hash,d,chash)
-    for d in range(1,base) if num and len+1 <= maxlen else []: # right
-        num2 = num*base+d
-        if prob_prime_test(num2):
-            ctree,cbytes,chash = tp_lor(base,len+1,num2,bytes([1,d]),maxlen)
-            children[base+d] = ctree
-            output += cbytes
-            hash = hash_update(hash,base+d,chash)
-    output += b'\xff' # end
-    return (((len,num,hash),children),output,hash)
-
-def tp_lar(base: int, len: int, num: int, root: bytes, maxlen: int) -> TPRet:
-    children = dict()
-    output = root
-    hash = hash_init(num)
+# child of a node as (key,length,number,place,value bytes)
+# the key is used for the children dict and the hash
+# place is base**length, the value of a digit appended on the left
+TPChild = Tuple[int,int,int,int,bytes]
+
+# generates the prime children of (length,number,place) given base and maxlen
+TPChildren = Callable[[int,int,int,int,int],Iterator[TPChild]]
+
+# LAST_DIGITS[base] are the digits coprime to base, other last digits share a
+# factor with base so they are composite for numbers above base
+LAST_DIGITS = [[d for d in range(1,b) if gcd(d,b) == 1] for b in range(256)]
+
+# builds the tree with an explicit stack instead of recursion
+# stack frames are [length,number,place,hash,children,child iterator,key]
+# if emit_bytes, the output bytes are appended to a single bytearray in pre
+# order, otherwise they are skipped and the returned bytes are empty
+# children at maxlen are leaves and finished without a stack frame
+def tp_walk(base: int, len: int, num: int, root: bytes, maxlen: int,
+            children_func: TPChildren, emit_bytes: bool = False) -> TPRet:
+    output = bytearray(root if emit_bytes else b'')
+    place = base**len # only power computed, children multiply by base
+    stack = [[len,num,place,hash_init(num),{},
+              children_func(base,len,num,place,maxlen),0]]
+    while True:
+        frame = stack[-1]
+        for key,len2,num2,place2,cbytes in frame[5]: # next child
+            if emit_bytes:
+                output += cbytes
+            if len2 >= maxlen: # leaf
+                if emit_bytes:
+                    output.append(255) # end
+                hash = hash_init(num2)
+                frame[4][key] = ((len2,num2,hash),{})
+                frame[3] = hash_update(frame[3],key,hash)
+                continue
+            stack.append([len2,num2,place2,hash_init(num2),{},
+                          children_func(base,len2,num2,place2,maxlen),key])
+            break
+        else: # all children done
+            if emit_bytes:
+                output.append(255) # end
+            stack.pop()
+            len2,num2,_,hash,children,_,key = frame
+            tree = ((len2,num2,hash),children)
+            if not stack:
+                return (tree,bytes(output),hash)
+            parent = stack[-1]
+            parent[4][key] = tree
+            parent[3] = hash_update(parent[3],key,hash)
+
+def children_r(base: int, len: int, num: int, place: int, maxlen: int) \
+        -> Iterator[TPChild]:
+    if len+1 <= maxlen:
+        digits = LAST_DIGITS[base] if num else range(1,base)
+        prefix = num*base
+        place2 = place*base
+        for d in digits:
+            num2 = prefix+d
+            if prob_prime_test(num2):
+                yield (d,len+1,num2,place2,bytes([d]))
+
+def children_l(base: int, len: int, num: int, place: int, maxlen: int) \
+        -> Iterator[TPChild]:
+    if len+1 <= maxlen:
+        digits = range(1,base)
+        place2 = place*base
+        for d in digits:
+            num2 = d*place+num
+            if prob_prime_test(num2):
+                yield (d,len+1,num2,place2,bytes([d]))
+
+def children_lor(base: int, len: int, num: int, place: int, maxlen: int) \
+        -> Iterator[TPChild]:
+    if len+1 <= maxlen:
+        digits = range(1,base)
+        place2 = place*base
+        for d in digits:
+            num2 = d*place+num
+            if prob_prime_test(num2): # left
+                yield (d,len+1,num2,place2,bytes([0,d]))
+        digits = LAST_DIGITS[base]
+        prefix = num*base
+        for d in digits if num else []:
+            num2 = prefix+d
+            if prob_prime_test(num2): # right
+                yield (base+d,len+1,num2,place2,bytes([1,d]))
+
+def children_lar(base: int, len: int, num: int, place: int, maxlen: int) \
+        -> Iterator[TPChild]:
+    place_l = place*base # left digit place value after appending right
     for dl in range(1 if num else 0, base): # allow 0 for 0 root
-        for dr in range(1 if num or dl == 0 else 0, base):
-            num2 = dl*(base**(len+1))+base*num+dr
-            len2 = len + (2 if num or dl else 1)
-            if len2 <= maxlen and prob_prime_test(num2):
-                ctree,cbytes,chash = tp_lar(base,len2,num2,
-                                            bytes([dl,dr]),maxlen)
-                children[dl*base+dr] = ctree
+        if num or dl: # 2 digits appended
+            len2,place2 = len+2,place_l*base
+        else: # single digit root
+            len2,place2 = len+1,place_l
+        if len2 > maxlen:
+            continue
+        digits = LAST_DIGITS[base] if num else range(1 if dl == 0 else 0, base)
+        prefix = dl*place_l+base*num
+        for dr in digits:
+            num2 = prefix+dr
+            if prob_prime_test(num2):
+                yield (dl*base+dr,len2,num2,place2,bytes([dl,dr]))
+
+# builds the same tree as tp_walk, but the nodes in the first split levels
+# are expanded here and their subtrees are built by worker processes
+# (prime testing holds the GIL so threads would not help)
+def tp_parallel(base: int, len: int, num: int, root: bytes, maxlen: int,
+                children_func: TPChildren, emit_bytes: bool = False,
+                split: int = 2, workers: Optional[int] = None) -> TPRet:
+    # fork avoids importing everything again in each worker, it is only used
+    # on linux since fork without exec is unsafe on macos
+    context = multiprocessing.get_context('fork') \
+        if sys.platform.startswith('linux') else None
+    with ProcessPoolExecutor(workers,mp_context=context) as executor:
+        # returns a future for a subtree or (length,number,root,children)
+        def expand(len: int, num: int, place: int, root: bytes,
+                   depth: int) -> Any:
+            if depth == 0:
+                return executor.submit(tp_walk,base,len,num,root,maxlen,
+                                       children_func,emit_bytes)
+            return (len,num,root,[(key,expand(len2,num2,place2,cbytes,depth-1))
+                for key,len2,num2,place2,cbytes
+                in children_func(base,len,num,place,maxlen)])
+        # combines results like tp_walk does when a node is finished
+        def collect(node: Any) -> TPRet:
+            if isinstance(node,Future):
+                return node.result()
+            len,num,root,subtrees = node
+            children = {}
+            output = bytearray(root if emit_bytes else b'')
+            hash = hash_init(num)
+            for key,subtree in subtrees:
+                ctree,cbytes,chash = collect(subtree)
+                children[key] = ctree
                 output += cbytes
-                hash = hash_update(hash,dl*base+dr,chash)
-    output += b'\xff' # end
-    return (((len,num,hash),children),output,hash)
+                hash = hash_update(hash,key,chash)
+            if emit_bytes:
+                output.append(255) # end
+            return (((len,num,hash),children),bytes(output),hash)
+        return collect(expand(len,num,base**len,root,split))
+
+def tp_r(base: int, len: int, num: int, root: bytes, maxlen: int,
+         emit_bytes: bool = False) -> TPRet:
+    return tp_walk(base,len,num,root,maxlen,children_r,emit_bytes)
+
+def tp_l(base: int, len: int, num: int, root: bytes, maxlen: int,
+         emit_bytes: bool = False) -> TPRet:
+    return tp_walk(base,len,num,root,maxlen,children_l,emit_bytes)
+
+def tp_lor(base: int, len: int, num: int, root: bytes, maxlen: int,
+           emit_bytes: bool = False) -> TPRet:
+    return tp_walk(base,len,num,root,maxlen,children_lor,emit_bytes)
 
+def tp_lar(base: int, len: int, num: int, root: bytes, maxlen: int,
+           emit_bytes: bool = False) -> TPRet:
+    return tp_walk(base,len,num,root,maxlen,children_lar,emit_bytes)
+
+# BIT_TABLES[i] maps each byte value to its bit i (for bytes.translate)
+BIT_TABLES = [bytes((b >> i) & 1 for b in range(256)) for i in range(8)]
+
+# rows for each length are lists indexed by number of children, allocated
+# when the length is first seen (max length is unbounded by default)
 class TPStats:
-    def __init__(self):
-        self.hashes = []
-        self.pmin = dict() # length -> (children -> min prime)
-        self.pmax = dict() # length -> (children -> max prime)
-        self.counts = dict() # length -> (children -> count)
+    def __init__(self, max_children: int):
+        self.max_children = max_children
+        self.hashes = array('Q') # 64 bit values stored compactly
+        self.pmin: Dict[int,List[int]] = {} # length -> min prime (0 if none)
+        self.pmax: Dict[int,List[int]] = {} # length -> max prime (0 if none)
+        self.counts: Dict[int,List[int]] = {} # length -> count
     def insert_hash(self, hash: int):
         self.hashes.append(hash)
     def update(self, num: int, len: int, children: int):
-        if len not in self.counts:
-            self.counts[len] = dict()
-            self.pmin[len] = dict()
-            self.pmax[len] = dict()
-        if children not in self.counts[len]:
-            self.counts[len][children] = 0
-            self.pmin[len][children] = num
-            self.pmax[len][children] = num
-        self.counts[len][children] += 1
-        self.pmin[len][children] = min(self.pmin[len][children],num)
-        self.pmax[len][children] = max(self.pmax[len][children],num)
+        counts = self.counts.get(len)
+        if counts is None:
+            counts = self.counts[len] = [0]*self.max_children
+            self.pmin[len] = [0]*self.max_children
+            self.pmax[len] = [0]*self.max_children
+        pmin,pmax = self.pmin[len],self.pmax[len]
+        if counts[children] == 0:
+            pmin[children] = pmax[children] = num
+        elif num < pmin[children]:
+            pmin[children] = num
+        elif num > pmax[children]:
+            pmax[children] = num
+        counts[children] += 1
     def get_hash_modular_distribution(self, mod: int) -> List[int]:
         assert mod > 0
-        ret = [0 for _ in range(mod)]
-        for hash in self.hashes:
-            ret[hash%mod] += 1
-        return ret
+        counts = Counter(map(mod.__rmod__,self.hashes))
+        return [counts[i] for i in range(mod)]
+    # counts bits with bytes operations, byte j of every hash is the slice
+    # raw[j::8] and translating it with BIT_TABLES[i] leaves bit i of each
     def get_hash_bit_distribution(self) -> List[int]:
-        ret = [0 for _ in range(64)]
-        for hash in self.hashes:
-            for i in range(64):
-                ret[i] += hash%2
-                hash //= 2
+        raw = self.hashes.tobytes()
+        ret = []
+        for j in range(8):
+            # byte with bits 8*j to 8*j+7
+            col = raw[j::8] if sys.byteorder == 'little' else raw[7-j::8]
+            ret += [col.translate(BIT_TABLES[i]).count(1) for i in range(8)]
         return ret
 
 # adds information to stats object
+# nodes are visited with a stack, the order does not matter for stats
 def tp_tree_stats(root: TPTree, stats: TPStats):
-    (length,number,hash),subtrees = root
-    if len(subtrees) > 0: # leaf hashes bloat lower bit counts
-        stats.insert_hash(hash)
-    stats.update(number,length,len(subtrees))
-    for subtree in subtrees.values():
-        tp_tree_stats(subtree,stats)
-
-# helper function for print_stats
-def get_values(max_children: int, obj: Dict[int,int]) -> List[int]:
-    return [obj[i] if i in obj else 0 for i in range(max_children)]
+    stack = [root]
+    while stack:
+        (length,number,hash),subtrees = stack.pop()
+        if len(subtrees) > 0: # leaf hashes bloat lower bit counts
+            stats.insert_hash(hash)
+        stats.update(number,length,len(subtrees))
+        stack.extend(subtrees.values())
 
 # print stats like the C program
 def print_stats(stats: TPStats, args: argparse.Namespace):
@@ -179,29 +305,25 @@ def print_stats(stats: TPStats, args: argparse.Namespace):
     print(f'# base = {args.base}')
     print(f'# root = {args.root}')
     print(f'# max_length = {args.max_length}')
-    max_children = args.base
+    max_children = stats.max_children
     if args.prime_type == 'lor':
         print(f'# NOTE: counts are not applicable')
-        max_children *= 2
     if args.prime_type == 'lar':
-        max_children *= args.base
         len_order = sorted(filter(lambda x: x % 2 == 1, stats.counts.keys())) \
                 + sorted(filter(lambda x: x % 2 == 0, stats.counts.keys()))
     else:
         len_order = sorted(stats.counts.keys())
     print('digits,all'+''.join(f',{k}' for k in range(max_children)))
     for l in len_order:
-        all_min = min(stats.pmin[l].values())
-        all_max = max(stats.pmax[l].values())
-        all_count = sum(stats.counts[l].values())
+        counts,pmin,pmax = stats.counts[l],stats.pmin[l],stats.pmax[l]
+        all_min = min(p for p,c in zip(pmin,counts) if c)
+        all_max = max(pmax)
+        all_count = sum(counts)
         if l == 0 or all_count == 0:
             continue # skip unnecessary row
-        print(f'{l},{all_count}'+''.join(f',{i}'
-            for i in get_values(max_children,stats.counts[l])))
-        print(f',{all_min}'+''.join(f',{i}'
-            for i in get_values(max_children,stats.pmin[l])))
-        print(f',{all_max}'+''.join(f',{i}'
-            for i in get_values(max_children,stats.pmax[l])))
+        print(f'{l},{all_count}'+''.join(f',{i}' for i in counts))
+        print(f',{all_min}'+''.join(f',{i}' for i in pmin))
+        print(f',{all_max}'+''.join(f',{i}' for i in pmax))
     #print(f'# hash = {stats.hashes[0]}')
 
 if __name__ == '__main__':
@@ -214,28 +336,48 @@ if __name__ == '__main__':
         help='type of truncatable primes (r, l, lor, lar)')
     parser.add_argument('-r','--root',default='0',
         help='root of recursion tree (>= 0, 0 for full tree)')
+    parser.add_argument('-e','--emit_bytes',action='store_true',
+        help='serialize the tree and output its length and md5 (default off)')
+    parser.add_argument('-j','--jobs',default='1',
+        help='worker processes (default 1 to not use any, 0 for cpu count)')
     args = parser.parse_args()
     #print('args =',args)
     args.base = int(args.base)
     args.max_length = int(args.max_length)
     args.root = int(args.root)
-    funcs = \
+    args.jobs = int(args.jobs)
+    children_funcs = \
     {
-        'r': tp_r,
-        'l': tp_l,
-        'lor': tp_lor,
-        'lar': tp_lar
+        'r': children_r,
+        'l': children_l,
+        'lor': children_lor,
+        'lar': children_lar
     }
-    tptree,tpbytes,tphash = funcs[args.prime_type](args.base,count_digits(
-        args.root,args.base),args.root,
-        b'\xff'*((len(args.prime_type)+1)//2),args.max_length)
-    #print('bytes length =',len(tpbytes))
-    #print('bytes hash (md5) =',hashlib.md5(tpbytes).hexdigest())
+    # numbers are mpz from the root so candidates are computed with GMP
+    root = mpz(args.root)
+    tpargs = (args.base,count_digits(root,args.base),root,
+        b'\xff'*((len(args.prime_type)+1)//2),args.max_length,
+        children_funcs[args.prime_type],args.emit_bytes)
+    if args.jobs == 1:
+        tptree,tpbytes,tphash = tp_walk(*tpargs)
+    else:
+        tptree,tpbytes,tphash = tp_parallel(*tpargs,
+            workers=args.jobs if args.jobs > 1 else None)
     #print('tree hash (custom) =',tphash)
-    stats = TPStats()
+    # child counts are below base, 2*base for lor (left or right digit),
+    # and base**2 for lar (2 digits)
+    max_children = args.base
+    if args.prime_type == 'lor':
+        max_children *= 2
+    if args.prime_type == 'lar':
+        max_children *= args.base
+    stats = TPStats(max_children)
     tp_tree_stats(tptree,stats)
     print_stats(stats,args)
     print(f'# hash = {tptree[0][2]}')
+    if args.emit_bytes:
+        print(f'# bytes_length = {len(tpbytes)}')
+        print(f'# bytes_md5 = {hashlib.md5(tpbytes).hexdigest()}')
     #print('hash bit distribution =',stats.get_hash_bit_distribution())
     #while True:
     #    m = int(input())
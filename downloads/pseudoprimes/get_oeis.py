@@ -1,57 +1,52 @@
 import argparse
+import re
 import requests
 import sys
 
-def get_oeis_b_file(id):
-    req = requests.get('https://oeis.org/A%s/b%s.txt'%(id,id))
+# session is an optional requests.Session for reusing connections
+def get_oeis_b_file(id,session=None):
+    get = requests.get if session is None else session.get
+    req = get('https://oeis.org/A%s/b%s.txt'%(id,id))
     assert req.ok
-    return req.text
-
-ap = argparse.ArgumentParser(description='download OEIS B file')
-ap.add_argument('id',help='the 6 digit OEIS sequence number')
-ap.add_argument('-c','--keep-comments',
-    help='keeps comments (starting with #, removed by default)',
-    action='store_true')
-ap.add_argument('-b','--keep-blanks',
-    help='keeps blank lines (remove them by default)',
-    action='store_true')
-ap.add_argument('-i','--keep-indexes',
-    help='keeps sequence indexes (removed by default)',
-    action='store_true')
-ap.add_argument('-f','--check-format',
-    help='runs extra checks on B file format',
-    action='store_true')
-args = ap.parse_args()
-
-assert len(args.id) == 6 and args.id.isdigit()
-
-lines = get_oeis_b_file(args.id).splitlines()
-
-def check_line(line):
-    if line == '': return True # blank
-    if line.startswith('#'): return True # comment
-    if line != line.strip(): return False # extra whitespace not allowed
-    line2 = line.split()
-    if len(line2) != 2: return False # 2 integers
-    if not line2[0].isdigit(): return False
-    if not line2[1].isdigit(): return False
-    return '%d %d'%(int(line2[0]),int(line2[1])) == line # proper format
-
-if args.check_format:
-    for line in lines:
-        assert check_line(line)
-
-if not args.keep_comments:
-    lines = list(filter(lambda l : not l.startswith('#'), lines))
-
-if not args.keep_blanks:
-    lines = list(filter(lambda l : len(l) > 0, lines))
-
-def remove_index(l):
-    if l == '' or l.startswith('#'): return l
-    return l[l.find(' ')+1:]
-
-if not args.keep_indexes:
-    lines = list(map(remove_index,lines))
-
-print('\n'.join(lines))
+    return req.content
+
+# blank, comment, or 2 nonnegative integers without leading zeros separated
+# by a single space (no extra whitespace)
+LINE_FORMAT = re.compile(rb'|#.*|(?:0|[1-9][0-9]*) (?:0|[1-9][0-9]*)')
+
+# apply the format check, filters, and index removal to B file content
+def process_b_file(content,keep_comments=False,keep_blanks=False,
+        keep_indexes=False,check_format=False):
+    lines = content.splitlines()
+    if check_format:
+        assert all(LINE_FORMAT.fullmatch(line) for line in lines)
+    # single pass over the lines
+    lines = (line if keep_indexes or line == b'' or line.startswith(b'#')
+                else line[line.find(b' ')+1:]
+            for line in lines
+            if (keep_comments or not line.startswith(b'#'))
+                and (keep_blanks or line != b''))
+    return b'\n'.join(lines)+b'\n'
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='download OEIS B file')
+    ap.add_argument('id',help='the 6 digit OEIS sequence number')
+    ap.add_argument('-c','--keep-comments',
+        help='keeps comments (starting with #, removed by default)',
+        action='store_true')
+    ap.add_argument('-b','--keep-blanks',
+        help='keeps blank lines (remove them by default)',
+        action='store_true')
+    ap.add_argument('-i','--keep-indexes',
+        help='keeps sequence indexes (removed by default)',
+        action='store_true')
+    ap.add_argument('-f','--check-format',
+        help='runs extra checks on B file format',
+        action='store_true')
+    args = ap.parse_args()
+
+    assert len(args.id) == 6 and args.id.isdigit()
+
+    sys.stdout.buffer.write(process_b_file(get_oeis_b_file(args.id),
+        args.keep_comments,args.keep_blanks,
+        args.keep_indexes,args.check_format))
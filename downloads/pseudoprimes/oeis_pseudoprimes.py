@@ -1,7 +1,33 @@
 import csv
-import subprocess
+import requests
+import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from get_oeis import get_oeis_b_file, process_b_file
 
-# for each sequence run get_oeis.py -if ID
+# for each sequence get the B file like get_oeis.py -if ID
+# downloads run concurrently in threads sharing one session
+
+MAX_WORKERS = 16
+
+session = requests.Session()
+session.mount('https://',requests.adapters.HTTPAdapter(
+    pool_connections=MAX_WORKERS,pool_maxsize=MAX_WORKERS))
+
+# a failed download is reported and leaves an empty file, the other
+# downloads continue
+def fetch_one(job):
+    id,outpath = job
+    # single write so lines from different threads do not interleave
+    sys.stdout.write('downloading OEIS A%s to %s\n'%(id,outpath))
+    with open(outpath,'wb') as outfile:
+        try:
+            content = get_oeis_b_file(id,session)
+            outfile.write(process_b_file(content,
+                keep_indexes=True,check_format=True))
+        except Exception:
+            sys.stderr.write('error: OEIS A%s failed\n%s'
+                             %(id,traceback.format_exc()))
 
 input = csv.reader(open('oeis_pseudoprimes.csv','r'))
 
@@ -11,10 +37,12 @@ assert header[0] == 'base'
 
 print('header =',header)
 
+jobs = []
 for row in input:
     base = row[0]
     for i in range(1,len(header)):
         if not row[i]: continue
-        print('downloading OEIS A%s to %s_base_%s.txt'%(row[i],header[i],base))
-        subprocess.run(['python3','get_oeis.py','-if',row[i]],
-                       stdout=open('%s_base_%s.txt'%(header[i],base),'w'))
+        jobs.append((row[i],'%s_base_%s.txt'%(header[i],base)))
+
+with ThreadPoolExecutor(MAX_WORKERS) as ex:
+    ex.map(fetch_one,jobs)